@@ -1,24 +1,36 @@
 import dash
 from dash import dcc, html, dash_table
+from dash.dash_table.Format import Format, Scheme
 import plotly.express as px
 import pandas as pd
+import numpy as np
 import io
 import base64
+import hashlib
 import json
 import os
+import pickle
+import tempfile
+import uuid
 from dash.dependencies import Input, Output, State
+from flask_caching import Cache
 
 # Initialize Dash app
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 app.title = "CSV Data Visualization"
 server = app.server
 
+# Server-side cache for processed uploads, keyed by a digest of the uploaded CSV content
+cache = Cache(server, config={'CACHE_TYPE': 'FileSystemCache', 'CACHE_DIR': '.cache'})
+
 # Define file path for storing processed data
-PROCESSED_DATA_FILE = 'output_data.json'
+PROCESSED_DATA_FILE = 'output_data.pkl'
+LEGACY_DATA_FILE = 'output_data.json'  # read only when no pickle has been written yet
+RESULT_TIMEOUT = 60 * 60 * 24  # per-upload results expire after a day; sessions then fall back to the saved file
 
 # Store uploaded data persistently
 app.layout = html.Div([
-    dcc.Store(id='stored-data'),  # Stores the cleaned DataFrame
+    dcc.Store(id='stored-data'),  # Stores the cache key of the processed upload
     dcc.Location(id='url', refresh=False),  # URL handling for navigation
 
     html.H1("📂 Upload CSV & Visualize"),
@@ -40,85 +52,108 @@ app.layout = html.Div([
     html.Div(id='page-content')  # Main content placeholder
 ])
 
+# Function to parse a single uploaded CSV
+def read_uploaded_csv(content):
+    content_type, content_string = content.split(',', 1)
+    decoded = base64.b64decode(content_string)
+    return pd.read_csv(
+        io.BytesIO(decoded),
+        usecols=['PHONE NO', 'DRIVER PRICE', 'JOB DATE'],
+        dtype={'PHONE NO': 'string', 'DRIVER PRICE': 'float64', 'JOB DATE': 'string'},
+        index_col=False
+    )
+
 # Function to clean and merge CSV data
 def clean_and_merge_data(contents_list):
-    dfs = []
-    for content in contents_list:
-        content_type, content_string = content.split(',')
-        decoded = base64.b64decode(content_string)
-        df = pd.read_csv(io.StringIO(decoded.decode('utf-8')), index_col=False)
-        dfs.append(df)
+    # Parse uploads lazily and skip the extra defensive copy in concat
+    merged_df = pd.concat((read_uploaded_csv(content) for content in contents_list), ignore_index=True, copy=False)
+    mask = merged_df['PHONE NO'].notna() & (merged_df['PHONE NO'] != "")
+    # A single copy: each column lands in its own contiguous 1-D block for the reductions downstream
+    df_cleaned = merged_df.loc[mask, ['PHONE NO', 'DRIVER PRICE', 'JOB DATE']].copy()
+    df_cleaned.columns = ['phone', 'price', 'job_date']
+
+    # Keep job_date as datetime64 (truncated to the day) instead of boxing Python date objects;
+    # unparsable dates become NaT rather than failing the whole upload
+    df_cleaned['job_date'] = pd.to_datetime(df_cleaned['job_date'], format="%d/%m/%y %H:%M:%S", errors='coerce').dt.normalize()
+    # Group and count customers on integer category codes rather than hashing phone strings
+    df_cleaned['phone'] = df_cleaned['phone'].astype('category')
+    # Store prices rounded to whole cents as integers: sums of those cents are exact and int32 halves the
+    # bytes of float64 on every reduction; fall back to int64 when a price exceeds int32 (~21.47M units)
+    price_cents = (df_cleaned['price'].fillna(0) * 100).round()
+    cents_dtype = 'int32' if price_cents.abs().max() <= np.iinfo(np.int32).max else 'int64'
+    df_cleaned['price'] = price_cents.astype(cents_dtype)
+
+    return df_cleaned
 
-    merged_df = pd.concat(dfs, ignore_index=True)
-    df_needed = merged_df[['PHONE NO', 'DRIVER PRICE', 'JOB DATE']]
-    df_needed.columns = ['phone', 'price', 'job_date']
-    df_cleaned = df_needed[df_needed["phone"].notna() & (df_needed["phone"] != "")]
+# Function to aggregate per-month customer counts & revenue over integer codes
+def aggregate_months(month_codes, phone_codes, is_new, price, n_months, n_phones):
+    # Each (month, phone) pair maps to one int64 key; one hash-based dedupe then a count per month
+    pair_keys = month_codes.astype(np.int64) * n_phones + phone_codes
+    total_customers = np.bincount(pd.unique(pair_keys) // n_phones, minlength=n_months)
+    new_customers = np.bincount(pd.unique(pair_keys[is_new]) // n_phones, minlength=n_months)
 
-    df_cleaned.loc[:, "job_date"] = pd.to_datetime(df_cleaned["job_date"], format="%d/%m/%y %H:%M:%S", errors='coerce', dayfirst=True).dt.date
+    total_revenue = np.bincount(month_codes, weights=price, minlength=n_months)
+    new_revenue = np.bincount(month_codes[is_new], weights=price[is_new], minlength=n_months)
 
-    return df_cleaned
+    return total_customers, new_customers, total_revenue, new_revenue
 
 # Function to compute monthly breakdown & LTV
 def monthly_breakdown(df):
-    df['job_date'] = pd.to_datetime(df['job_date'], errors='coerce')
     df['month'] = df['job_date'].dt.to_period('M')
 
-    first_visits = df.groupby('phone')['job_date'].min().reset_index()
-    first_visits.columns = ['phone', 'first_visit_date']
-    df = pd.merge(df, first_visits, on='phone')
-    df['first_visit_month'] = df['first_visit_date'].dt.to_period('M')
-
-    monthly_results = []
-    for month in sorted(df['month'].unique()):
-        month_data = df[df['month'] == month]
-        total_customers = month_data['phone'].nunique()
-        new_customers = month_data[month_data['month'] == month_data['first_visit_month']]['phone'].nunique()
-        returning_customers = total_customers - new_customers
-
-        new_percentage = round((new_customers / total_customers * 100), 2) if total_customers > 0 else 0
-        returning_percentage = round((returning_customers / total_customers * 100), 2) if total_customers > 0 else 0
-
-        month_revenue = month_data['price'].sum()
-        new_revenue = month_data[month_data['month'] == month_data['first_visit_month']]['price'].sum()
-        returning_revenue = month_revenue - new_revenue
-
-        monthly_results.append({
-            'month': str(month),
-            'total_customers': total_customers,
-            'new_customers': new_customers,
-            'returning_customers': returning_customers,
-            'new_percentage': new_percentage,
-            'returning_percentage': returning_percentage,
-            'total_revenue': month_revenue,
-            'new_customer_revenue': new_revenue,
-            'returning_customer_revenue': returning_revenue
-        })
-
-    monthly_df = pd.DataFrame(monthly_results)
-
-    # Convert DataFrame to JSON serializable format
-    monthly_dict = monthly_df.to_dict('records')
+    df['first_visit_month'] = df.groupby('phone', sort=False, observed=True)['job_date'].transform('min').dt.to_period('M')
+
+    # Compare month ordinals as plain int64 once; reused for both the customer and revenue splits
+    is_new = df['month'].astype('int64').to_numpy() == df['first_visit_month'].astype('int64').to_numpy()
+
+    month_codes, months = pd.factorize(df['month'], sort=True)
+    has_month = month_codes >= 0  # rows without a parsable job date have no month
+    total_customers, new_customers, month_revenue, new_revenue = aggregate_months(
+        month_codes[has_month],
+        df['phone'].cat.codes.to_numpy()[has_month],
+        is_new[has_month],
+        df['price'].to_numpy()[has_month],
+        len(months),
+        len(df['phone'].cat.categories)
+    )
+
+    monthly_df = pd.DataFrame({
+        'month': months.astype(str),
+        'total_customers': total_customers,
+        'new_customers': new_customers,
+        'returning_customers': total_customers - new_customers,
+        'new_percentage': (new_customers / total_customers * 100).round(2),
+        'returning_percentage': ((total_customers - new_customers) / total_customers * 100).round(2),
+        'total_revenue': month_revenue / 100,  # cents -> currency units
+        'new_customer_revenue': new_revenue / 100,
+        'returning_customer_revenue': (month_revenue - new_revenue) / 100
+    })
 
     # LTV Calculations
-    total_revenue = df['price'].sum()
+    total_revenue = df['price'].sum() / 100
     unique_customers = df['phone'].nunique()
     basic_ltv = total_revenue / unique_customers if unique_customers > 0 else 0
 
     avg_purchase_value = total_revenue / len(df) if len(df) > 0 else 0
     avg_purchase_frequency = len(df) / unique_customers if unique_customers > 0 else 0
 
-    df_sorted = df.sort_values(['phone', 'job_date'])
-    df_sorted['next_visit'] = df_sorted.groupby('phone')['job_date'].shift(-1)
-    df_sorted['days_between_visits'] = (df_sorted['next_visit'] - df_sorted['job_date']).dt.days
+    # Sort visits by (phone, day) on integer codes and diff consecutive visits of the same customer
+    has_date = df['job_date'].notna().to_numpy()
+    phone_codes = df['phone'].cat.codes.to_numpy()[has_date]
+    visit_days = df['job_date'].to_numpy()[has_date].astype('datetime64[D]').astype(np.int64)
+    order = np.lexsort((visit_days, phone_codes))
+    phone_codes, visit_days = phone_codes[order], visit_days[order]
+    same_customer = phone_codes[1:] == phone_codes[:-1]
+    days_between_visits = np.diff(visit_days)[same_customer]
 
-    avg_days_between_visits = df_sorted['days_between_visits'].mean() if not df_sorted['days_between_visits'].isna().all() else 1
+    avg_days_between_visits = days_between_visits.mean() if days_between_visits.size else 1
     churn_threshold = 180
     avg_customer_lifespan = churn_threshold / avg_days_between_visits if avg_days_between_visits > 0 else 0
 
     advanced_ltv = avg_purchase_value * avg_purchase_frequency * avg_customer_lifespan
 
     return {
-        'monthly_breakdown': monthly_dict,  # Convert DataFrame to JSON serializable format
+        'monthly_breakdown': monthly_df.to_dict('records'),  # Convert DataFrame to JSON serializable format
         'Basic LTV': basic_ltv,
         'Advanced LTV': advanced_ltv,
         'Average Purchase Value': avg_purchase_value,
@@ -126,6 +161,18 @@ def monthly_breakdown(df):
         'Average Customer LifeSpan (Months)': avg_customer_lifespan
     }
 
+# Function to compute a stable cache key from the raw uploaded content
+def contents_digest(contents_list):
+    digest = hashlib.blake2b(digest_size=16)
+    for content in contents_list:
+        digest.update(content.encode())
+    return digest.hexdigest()
+
+# Clean & analyse the uploaded CSVs, skipping the work when the same content was seen before
+@cache.memoize(args_to_ignore=['contents_list'])
+def process_uploads(data_key, contents_list):
+    return monthly_breakdown(clean_and_merge_data(contents_list))
+
 # Callback to process uploaded data and store it persistently
 @app.callback(
     [Output('stored-data', 'data'), Output('loading-message', 'children')],
@@ -136,40 +183,82 @@ def update_data(contents_list):
     if not contents_list:
         return dash.no_update, "⚠️ No file uploaded!"
     
-    df_cleaned = clean_and_merge_data(contents_list)
-    processed_data = monthly_breakdown(df_cleaned)
+    data_key = contents_digest(contents_list)
+    processed_data = process_uploads(data_key, contents_list)
 
     # Load existing data if available
     existing_data = load_processed_data()
     if existing_data:
         existing_monthly_breakdown = existing_data.get('monthly_breakdown', [])
-        processed_data['monthly_breakdown'] = existing_monthly_breakdown + processed_data['monthly_breakdown']  # Append new breakdown
-
-    # Save the processed data to file
-    with open(PROCESSED_DATA_FILE, 'w') as f:
-        json.dump(processed_data, f)
-
-    return processed_data, "✅ Files uploaded & processed!"
+        # Append new breakdown on a fresh dict so the memoized upload result is never mutated
+        processed_data = {**processed_data, 'monthly_breakdown': existing_monthly_breakdown + processed_data['monthly_breakdown']}
+
+    # Save the processed data to file, and cache this upload's own result under a fresh key for its session
+    save_processed_data(processed_data)
+    result_key = uuid.uuid4().hex
+    cache.set(result_key, processed_data, timeout=RESULT_TIMEOUT)
+
+    return result_key, "✅ Files uploaded & processed!"
+
+# Function to write the processed data to file atomically, so readers never see a torn file
+def save_processed_data(processed_data):
+    # Each writer gets its own temp file in the target directory, so concurrent uploads never share one
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(os.path.abspath(PROCESSED_DATA_FILE)),
+        prefix='output_data.', suffix='.pkl.tmp', delete=False
+    ) as f:
+        pickle.dump(processed_data, f, protocol=5)
+    os.replace(f.name, PROCESSED_DATA_FILE)
 
 # Function to read the processed data from file
 def load_processed_data():
     if os.path.exists(PROCESSED_DATA_FILE):
-        with open(PROCESSED_DATA_FILE, 'r') as f:
+        with open(PROCESSED_DATA_FILE, 'rb') as f:
+            return pickle.load(f)
+    if os.path.exists(LEGACY_DATA_FILE):
+        with open(LEGACY_DATA_FILE, 'r') as f:
             return json.load(f)
     return None
 
+# Function to read the processed data cached for one upload
+def load_stored_data(result_key):
+    return cache.get(result_key)
+
+# Build the monthly trend figures once and round-trip them through Plotly's JSON encoder, so the cached
+# figures are plain lists/dicts that Dash can dump without converting numpy arrays on every render
+def make_figures(df):
+    line_fig = px.line(df, x='month', y=['new_customers', 'returning_customers'], markers=True)
+    bar_fig = px.bar(df, x='month', y=['total_revenue', 'new_customer_revenue', 'returning_customer_revenue'], barmode='group')
+    return json.loads(line_fig.to_json()), json.loads(bar_fig.to_json())
+
+# Function to compute a cache key that identifies a monthly breakdown by its content
+def breakdown_digest(monthly_breakdown):
+    return hashlib.blake2b(pickle.dumps(monthly_breakdown, protocol=5), digest_size=16).hexdigest()
+
+# Cached figures per dataset, whether it came from this session's upload or the saved file
+@cache.memoize(args_to_ignore=['monthly_breakdown'])
+def load_figures(dataset_key, monthly_breakdown):
+    return make_figures(pd.DataFrame(monthly_breakdown))
+
+# DataTable column spec; floats are rounded to 2 decimals in the browser instead of copying the frame with round()
+def table_column(df, col):
+    if pd.api.types.is_float_dtype(df[col]):
+        return {"name": col, "id": col, "type": "numeric", "format": Format(precision=2, scheme=Scheme.fixed)}
+    return {"name": col, "id": col}
+
 # Generate visual components including data table
-def generate_visuals(df):
+def generate_visuals(df, figures):
+    line_fig, bar_fig = figures
     return html.Div([
         html.H2("📊 Data Table"),
         dash_table.DataTable(
-            columns=[{"name": col, "id": col} for col in df.columns],
-            data=df.round(2).to_dict('records'),
+            columns=[table_column(df, col) for col in df.columns],
+            data=df.to_dict('records'),
             style_table={'overflowX': 'auto'}
         ),
         html.H2("📈 Monthly Trends"),
-        dcc.Graph(figure=px.line(df, x='month', y=['new_customers', 'returning_customers'], markers=True)),
-        dcc.Graph(figure=px.bar(df, x='month', y=['total_revenue', 'new_customer_revenue', 'returning_customer_revenue'], barmode='group')),
+        dcc.Graph(figure=line_fig),
+        dcc.Graph(figure=bar_fig),
     ])
 
 # Callback to update the page content
@@ -177,8 +266,10 @@ def generate_visuals(df):
     Output('page-content', 'children'),
     [Input('url', 'pathname'), Input('stored-data', 'data')]
 )
-def display_page(pathname, stored_data):
+def display_page(pathname, result_key):
+    stored_data = load_stored_data(result_key) if result_key else None
     if not stored_data:
+        # No upload in this session yet, or its cached result expired or was evicted: use the saved file
         stored_data = load_processed_data()
         if not stored_data:
             return "📥 Upload a file to begin."
@@ -198,7 +289,9 @@ def display_page(pathname, stored_data):
         ])
     
     # Monthly breakdown page
-    return generate_visuals(pd.DataFrame(stored_data['monthly_breakdown']))
+    monthly_breakdown = stored_data['monthly_breakdown']
+    figures = load_figures(breakdown_digest(monthly_breakdown), monthly_breakdown)
+    return generate_visuals(pd.DataFrame(monthly_breakdown), figures)
 
 if __name__ == '__main__':
     app.run(debug=True)